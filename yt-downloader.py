@@ -2,30 +2,63 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 import argparse
+import asyncio
+import errno
+import functools
+import json
 import logging
 import os
+import queue
 import re
 import shutil
+import socket
 import subprocess
 import sys
 import tempfile
+import threading
+import urllib.error
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from itertools import islice
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional
 from pytube import YouTube, Stream
+from pytube import request as pytube_request
 from pytube.exceptions import RegexMatchError, VideoUnavailable, MembersOnly, LiveStreamError
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger("yt_downloader")
+shutil.COPY_BUFSIZE = 4 << 20
+
+SEGMENT_SIZE = 8 * 1024 * 1024
+MAX_CONNECTIONS = 8
+READ_CHUNK = 4 * 1024 * 1024
+HTTP_TIMEOUT = 30
+PIPE_BUFSIZE = 1 << 20
+PROGRESS_INTERVAL = 0.1
+CANCEL_POLL_INTERVAL = 0.2
+WRITE_CHUNK = 1024 * 1024
+WRITE_QUEUE_SIZE = 4
 
-YOUTUBE_URL_RE = re.compile(r"(https?://)?(www\.)?(youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)(?P<id>[-_0-9A-Za-z]+)")
+YOUTUBE_URL_RE = re.compile(r"\A<?((?i:https?)://)?((?:[-\w]+\.)*)(youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)(?P<id>[-_0-9A-Za-z]+)", re.ASCII)
+_UNSAFE_CHARS_RE = re.compile(r'[\\/*?:"<>|]')
+_WS_RE = re.compile(r"\s+")
+_RES_RE = re.compile(r"\A\d{3,4}p\Z", re.ASCII)
 
 def is_youtube_url(url: str) -> bool:
-    return bool(YOUTUBE_URL_RE.search(url))
+    return "youtu" in url and bool(YOUTUBE_URL_RE.match(url.strip()))
 
 def fs_safe_filename(name: str) -> str:
-    safe = re.sub(r'[\\/*?:"<>|]', "_", name).strip()
-    safe = re.sub(r"\s+", " ", safe)
-    return safe
+    return _WS_RE.sub(" ", _UNSAFE_CHARS_RE.sub("_", name).strip())
 
 def unique_path(path: Path) -> Path:
     if not path.exists():
@@ -40,21 +73,437 @@ def unique_path(path: Path) -> Path:
             return candidate
         i += 1
 
+def claim_path(path: Path) -> Path:
+    # O_EXCL makes check-and-create one step, so concurrent downloads never share
+    # a name; a fresh directory costs a single create and no stat() calls.
+    candidate = path
+    while True:
+        try:
+            os.close(os.open(candidate, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            return candidate
+        except FileExistsError:
+            candidate = unique_path(path)
+
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"})
+
+def _size_connection_pool(jobs: int) -> None:
+    # Each job runs up to two streams with MAX_CONNECTIONS segments in flight; a
+    # smaller pool discards the surplus connections and loses keep-alive.
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=jobs * 2 * MAX_CONNECTIONS, max_retries=Retry(total=3, backoff_factor=0.3))
+    _SESSION.mount("https://", adapter)
+    _SESSION.mount("http://", adapter)
+
+_size_connection_pool(1)
+
+class _SessionResponse:
+    def __init__(self, resp: requests.Response):
+        self._resp = resp
+        self.status = resp.status_code
+        resp.raw.decode_content = True
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._resp.raw.read(amt)
+    def readinto(self, b) -> int:
+        raw = self._resp.raw
+        # urllib3's readinto() is read() plus a copy; for undecoded bodies go
+        # straight to the http.client response so bytes land in the caller's buffer.
+        fp = getattr(raw, "_fp", None)
+        if fp is None or "content-encoding" in self._resp.headers:
+            return raw.readinto(b)
+        return fp.readinto(b)
+    def info(self):
+        return self._resp.headers
+    def close(self) -> None:
+        raw = self._resp.raw
+        fp = getattr(raw, "_fp", None)
+        if fp is not None and fp.isclosed():
+            # Body fully read behind urllib3's back: hand the connection back to the pool.
+            raw.release_conn()
+        self._resp.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+def _session_request(url, method=None, headers=None, data=None, timeout=None) -> _SessionResponse:
+    if not url.lower().startswith("http"):
+        raise ValueError("Invalid URL")
+    if data and not isinstance(data, bytes):
+        data = json.dumps(data).encode("utf-8")
+    if not isinstance(timeout, (int, float)):
+        timeout = HTTP_TIMEOUT
+    try:
+        resp = _SESSION.request(method or ("POST" if data else "GET"), url, headers=headers, data=data, timeout=timeout, stream=(method != "HEAD"))
+    except requests.Timeout as e:
+        raise urllib.error.URLError(socket.timeout(str(e)))
+    except requests.ConnectionError as e:
+        raise urllib.error.URLError(e)
+    if resp.status_code >= 400:
+        resp.close()
+        raise urllib.error.HTTPError(url, resp.status_code, resp.reason, resp.headers, None)
+    return _SessionResponse(resp)
+
+# Route pytube's metadata requests through the shared keep-alive session too.
+pytube_request._execute_request = _session_request
+
+# Set on Ctrl-C in batch mode so every worker thread unwinds at its next poll.
+_ABORT = threading.Event()
+
+def _raise_if_cancelled(*events: Optional[threading.Event]) -> None:
+    if _ABORT.is_set() or any(e is not None and e.is_set() for e in events):
+        raise RuntimeError("Download cancelled.")
+
+def _submit_daemon(fn, *args) -> Future:
+    # Daemon threads, unlike ThreadPoolExecutor workers, are not joined at
+    # interpreter exit, so an aborted download does not wait on in-flight requests.
+    fut: Future = Future()
+    def run():
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn(*args))
+        except BaseException as e:
+            fut.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return fut
+
+def _wait_result(fut: Future, *events: Optional[threading.Event]):
+    while True:
+        try:
+            return fut.result(timeout=CANCEL_POLL_INTERVAL)
+        except FuturesTimeoutError:
+            _raise_if_cancelled(*events)
+
+def _fetch_range(url: str, start: int, end: int, *cancel: Optional[threading.Event]) -> bytearray:
+    buf = bytearray(end - start + 1)
+    view = memoryview(buf)
+    pos = 0
+    with _session_request(f"{url}&range={start}-{end}") as resp:
+        # A server that ignores &range= sends the whole file; don't take its head as this segment.
+        length = resp.info().get("Content-Length")
+        if length is not None and int(length) != len(buf):
+            raise RuntimeError(f"Server sent {length} bytes for range {start}-{end}, expected {len(buf)}")
+        while pos < len(buf):
+            _raise_if_cancelled(*cancel)
+            n = resp.readinto(view[pos:pos + READ_CHUNK])
+            if not n:
+                break
+            pos += n
+        if pos == len(buf) and length is None and resp.readinto(bytearray(1)):
+            raise RuntimeError(f"Server sent more than {len(buf)} bytes for range {start}-{end}")
+    if pos != len(buf):
+        raise RuntimeError(f"Short read for range {start}-{end}: got {pos} bytes")
+    return buf
+
+def _fast_move(src: Path, dst: Path) -> None:
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    try:
+        if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+            with open(src, "rb") as a, open(dst, "wb") as b:
+                size = os.fstat(a.fileno()).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(b.fileno(), a.fileno(), offset, size - offset)
+                    if not sent:
+                        raise OSError(errno.EIO, f"Short copy ({offset} of {size} bytes)", str(dst))
+                    offset += sent
+        else:
+            shutil.copyfile(src, dst)
+    except BaseException:
+        # Never drop the source while only a partial copy exists.
+        dst.unlink(missing_ok=True)
+        raise
+    os.unlink(src)
+
+def _iter_serial(url: str, cancel: Optional[threading.Event], seq: bool = False) -> Iterator[bytes]:
+    for chunk in (pytube_request.seq_stream if seq else pytube_request.stream)(url):
+        _raise_if_cancelled(cancel)
+        yield chunk
+
+def _iter_stream(stream: Stream, cancel: Optional[threading.Event] = None) -> Iterator[bytes]:
+    # Sequence-numbered (OTF) streams answer &range= with 404; like Stream.download(),
+    # fall back to fetching them serially with seq_stream().
+    total = stream.filesize
+    if not total:
+        started = False
+        try:
+            for chunk in _iter_serial(stream.url, cancel):
+                started = True
+                yield chunk
+        except urllib.error.HTTPError as e:
+            if started or e.code != 404:
+                raise
+            yield from _iter_serial(stream.url, cancel, seq=True)
+        return
+    segments = ((start, min(start + SEGMENT_SIZE, total) - 1) for start in range(0, total, SEGMENT_SIZE))
+    stop = threading.Event()
+    try:
+        pending = deque(_submit_daemon(_fetch_range, stream.url, a, b, cancel, stop) for a, b in islice(segments, MAX_CONNECTIONS))
+        started = False
+        while pending:
+            try:
+                data = _wait_result(pending.popleft(), cancel)
+            except urllib.error.HTTPError as e:
+                if started or e.code != 404:
+                    raise
+                stop.set()
+                yield from _iter_serial(stream.url, cancel, seq=True)
+                return
+            started = True
+            for a, b in islice(segments, 1):
+                pending.append(_submit_daemon(_fetch_range, stream.url, a, b, cancel, stop))
+            yield data
+    finally:
+        stop.set()
+
+def _write_stream(stream: Stream, f: BinaryIO, cancel: Optional[threading.Event] = None) -> None:
+    remaining = stream.filesize
+    for data in _iter_stream(stream, cancel):
+        remaining -= len(data)
+        stream.on_progress(data, f, max(remaining, 0))
+
+class DiskWriter(threading.Thread):
+    def __init__(self, path: Path, maxsize: int = WRITE_QUEUE_SIZE):
+        super().__init__(name=f"DiskWriter({path.name})", daemon=True)
+        self.q: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.f = open(path, "wb", buffering=0)
+        self.error: Optional[BaseException] = None
+    def run(self):
+        try:
+            while (buf := self.q.get()) is not None:
+                if self.error is not None:
+                    continue
+                try:
+                    view = buf
+                    while view:
+                        view = view[self.f.write(view):]
+                except BaseException as e:
+                    self.error = e
+        finally:
+            self.f.close()
+    def write(self, buf) -> int:
+        if self.error is not None:
+            raise self.error
+        # Queue 1 MiB slices so the backlog is bounded in bytes, not segments.
+        view = memoryview(buf)
+        for i in range(0, len(view), WRITE_CHUNK):
+            self.q.put(view[i:i + WRITE_CHUNK])
+        return len(buf)
+    def close(self) -> None:
+        self.q.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+def _fetch_stream(stream: Stream, path: Path, cancel: Optional[threading.Event] = None) -> Path:
+    writer = DiskWriter(path)
+    writer.start()
+    try:
+        try:
+            _write_stream(stream, writer, cancel)
+        finally:
+            writer.close()
+    except BaseException:
+        _PROGRESS.discard(stream)
+        raise
+    stream.on_complete(str(path))
+    return path
+
+def _fetch_new_file(stream: Stream, path: Path) -> Path:
+    out = claim_path(path)
+    try:
+        return _fetch_stream(stream, out)
+    except BaseException:
+        out.unlink(missing_ok=True)
+        raise
+
+def _grow_pipe(fd: int) -> None:
+    if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, PIPE_BUFSIZE)
+        except OSError:
+            pass
+
+def _ffmpeg_mux_cmd(ffmpeg_path: str, video_in: str, audio_in: str, out_path: Path, codec_args: list[str], input_args: tuple[str, ...] = (), movflags: str = "+faststart", global_args: tuple[str, ...] = ()) -> list[str]:
+    cmd = [ffmpeg_path, "-y", *global_args]
+    for src in (video_in, audio_in):
+        cmd += [*input_args, "-seekable", "0", "-thread_queue_size", "1024", "-i", src]
+    cmd += codec_args
+    if out_path.suffix in (".mp4", ".mov"):
+        cmd += ["-movflags", movflags]
+    cmd += ["-avoid_negative_ts", "make_zero", str(out_path)]
+    return cmd
+
+def _probe_audio_codec(path: Path) -> Optional[str]:
+    ffprobe_path = shutil.which("ffprobe")
+    if not ffprobe_path:
+        return None
+    try:
+        out = subprocess.check_output([ffprobe_path, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name", "-of", "csv=p=0", str(path)], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode(errors="ignore").strip().lower() or None
+
+def _can_stream_mux(video_stream: Stream, audio_stream: Stream) -> bool:
+    return os.name == "posix" and video_stream.subtype == "mp4" and audio_stream.subtype == "mp4"
+
+def _mux_streamed(ffmpeg_path: str, video_stream: Stream, audio_stream: Stream, out_path: Path) -> subprocess.CompletedProcess:
+    rv, wv = os.pipe()
+    ra, wa = os.pipe()
+    _grow_pipe(wv)
+    _grow_pipe(wa)
+    # Fragmented output lets ffmpeg finish as soon as the last input byte lands,
+    # instead of a +faststart pass that rewrites the whole file afterwards.
+    # -xerror: a pipe cannot reach a trailing moov, and ffmpeg then logs
+    # "Error during demuxing" but still exits 0 unless told to fail.
+    cmd = _ffmpeg_mux_cmd(ffmpeg_path, f"/dev/fd/{rv}", f"/dev/fd/{ra}", out_path, ["-c", "copy"], input_args=("-f", "mp4"), movflags="+frag_keyframe+empty_moov", global_args=("-xerror",))
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=PIPE_BUFSIZE, pass_fds=(rv, ra))
+    except Exception:
+        os.close(wv)
+        os.close(wa)
+        raise
+    finally:
+        os.close(rv)
+        os.close(ra)
+    cancel = threading.Event()
+    def feed(stream: Stream, fd: int):
+        try:
+            with open(fd, "wb") as f:
+                _write_stream(stream, f, cancel)
+        except BrokenPipeError:
+            # ffmpeg stopped reading before the stream ended: the output is incomplete.
+            _PROGRESS.discard(stream)
+            return False
+        except BaseException:
+            _PROGRESS.discard(stream)
+            proc.kill()
+            raise
+        stream.on_complete(None)
+        return True
+    ex = ThreadPoolExecutor(max_workers=2)
+    try:
+        fv = ex.submit(feed, video_stream, wv)
+        fa = ex.submit(feed, audio_stream, wa)
+        stdout, stderr = proc.communicate()
+        fed = [fv.result(), fa.result()]
+    except BaseException:
+        cancel.set()
+        proc.kill()
+        out_path.unlink(missing_ok=True)
+        raise
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+    return subprocess.CompletedProcess(cmd, proc.returncode if all(fed) else (proc.returncode or 1), stdout, stderr)
+
+def _write_status(line: str) -> None:
+    sys.stderr.write(line)
+    sys.stderr.flush()
+
+def _format_progress(tag: str, bytes_remaining: int, total: Optional[int]) -> str:
+    if total:
+        downloaded = total - bytes_remaining
+        return f"[{tag}] {downloaded / total * 100:6.2f}% ({downloaded:,}/{total:,} bytes)"
+    return f"[{tag}] downloading... ({bytes_remaining} bytes remaining)"
+
+class _ProgressRenderer:
+    # One renderer for the whole process: concurrent titles share a single
+    # status line instead of overwriting each other's "\r" line.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state: dict[int, tuple[str, str, int, Optional[int]]] = {}
+        self.stop: Optional[threading.Event] = None
+    def _line(self, entries) -> str:
+        width = max(shutil.get_terminal_size().columns - 1, 1)
+        line = " || ".join(f"{title} | {_format_progress(tag, rem, total)}" for title, tag, rem, total in entries)
+        return "\r" + line[:width].ljust(width)
+    def _render(self, stop: threading.Event):
+        while not stop.wait(PROGRESS_INTERVAL):
+            with self.lock:
+                if stop.is_set():
+                    return
+                _write_status(self._line(self.state.values()))
+    def _pop(self, stream: Stream):
+        # Caller holds the lock. Stopping under the lock means the renderer can never
+        # redraw after this, so there is no need to join it.
+        last = self.state.pop(id(stream), None)
+        if last is not None:
+            _write_status(self._line(()) + "\r")
+            if not self.state:
+                self.stop.set()
+                self.stop = None
+        return last
+    def update(self, title: str, stream: Stream, bytes_remaining: int):
+        total = getattr(stream, "filesize", None) or getattr(stream, "filesize_approx", None)
+        tag = getattr(stream, "resolution", None) or getattr(stream, "abr", None) or stream.mime_type
+        with self.lock:
+            self.state[id(stream)] = (title, tag, bytes_remaining, total)
+            if self.stop is None:
+                self.stop = threading.Event()
+                threading.Thread(target=self._render, args=(self.stop,), name="progress", daemon=True).start()
+    def finish(self, title: str, stream: Stream, file_path: Optional[str]):
+        with self.lock:
+            last = self._pop(stream)
+            if last is not None:
+                _write_status(self._line((last,)).rstrip() + "\n")
+            logger.info("Completed: %s -> %s", title, file_path or "ffmpeg")
+    def discard(self, stream: Stream):
+        with self.lock:
+            self._pop(stream)
+
+_PROGRESS = _ProgressRenderer()
+
 def mk_progress_callbacks(title: str):
     def on_progress(stream: Stream, chunk: bytes, bytes_remaining: int):
-        total = getattr(stream, "filesize", None) or getattr(stream, "filesize_approx", None)
-        if total:
-            downloaded = total - bytes_remaining
-            pct = downloaded / total * 100
-            tag = getattr(stream, "resolution", None) or getattr(stream, "abr", None) or stream.mime_type
-            print(f"\r{title} | {tag} | {pct:6.2f}% ({downloaded:,}/{total:,} bytes)", end="", flush=True)
-        else:
-            print(f"\r{title} | downloading... ({bytes_remaining} bytes remaining)", end="", flush=True)
-    def on_complete(stream: Stream, file_path: str):
-        print()
-        logger.info("Completed: %s -> %s", title, file_path)
+        _PROGRESS.update(title, stream, bytes_remaining)
+    def on_complete(stream: Stream, file_path: Optional[str]):
+        _PROGRESS.finish(title, stream, file_path)
     return on_progress, on_complete
 
+def _res_key(stream: Stream) -> int:
+    return int(stream.resolution[:-1]) if stream.resolution else 0
+
+def _abr_key(stream: Stream) -> int:
+    return int(stream.abr[:-4]) if stream.abr else 0
+
+def _index_streams(streams) -> dict:
+    # Buckets: progressive mp4 / any, adaptive video-only mp4 / any, audio-only mp4 / any.
+    idx: dict = {"by_itag": {}, "pm": [], "pa": [], "am": [], "aa": [], "aum": [], "au": []}
+    for s in streams:
+        idx["by_itag"][s.itag] = s
+        mp4 = s.subtype == "mp4"
+        has_video, has_audio = s.includes_video_track, s.includes_audio_track
+        if s.is_progressive:
+            any_key, mp4_key = "pa", "pm"
+        elif has_video and not has_audio:
+            any_key, mp4_key = "aa", "am"
+        elif has_audio and not has_video:
+            any_key, mp4_key = "au", "aum"
+        else:
+            continue
+        idx[any_key].append(s)
+        if mp4:
+            idx[mp4_key].append(s)
+    # Ascending stable sort then reverse, like pytube's order_by(...).desc(): among
+    # equal resolutions/bitrates the stream listed last in the manifest comes first.
+    for key in ("pm", "pa", "am", "aa"):
+        idx[key].sort(key=_res_key)
+        idx[key].reverse()
+    for key in ("aum", "au"):
+        idx[key].sort(key=_abr_key)
+        idx[key].reverse()
+    return idx
+
+def _first_at_res(bucket: list, resolution: str) -> Optional[Stream]:
+    # Buckets are best-first with ties in reverse manifest order; filter(res=...).first()
+    # picks the first match in manifest order, so scan from the other end.
+    return next((s for s in reversed(bucket) if s.resolution == resolution), None)
+
 def download_video(url: str, output_dir: str = ".", quality: str = "best", list_streams: bool = False, itag: Optional[int] = None, merge_adaptive: bool = True) -> Optional[Path]:
     if not is_youtube_url(url):
         raise ValueError("Provided URL does not look like a YouTube URL.")
@@ -85,113 +534,179 @@ def download_video(url: str, output_dir: str = ".", quality: str = "best", list_
             res = getattr(s, "resolution", None) or getattr(s, "abr", None) or ""
             logger.info("  itag=%s  %s  %s  prog=%s", s.itag, s.mime_type, res, prog)
         return None
+    idx = _index_streams(streams)
+    best_audio = idx["au"][0] if idx["au"] else None
     if itag is not None:
-        stream = streams.get_by_itag(itag)
+        stream = idx["by_itag"].get(itag)
         if stream is None:
             raise ValueError(f"No stream with itag={itag} found.")
         if stream.is_progressive:
-            out_name = unique_path(output_dir_p / (title + "." + stream.subtype))
-            path = stream.download(output_path=str(output_dir_p), filename=out_name.name)
-            return Path(path)
+            out_name = output_dir_p / (title + "." + stream.subtype)
+            return _fetch_new_file(stream, out_name)
         else:
-            audio = streams.filter(only_audio=True).order_by("abr").desc().first()
-            if not audio:
+            if not best_audio:
                 raise RuntimeError("Couldn't find audio stream to pair with the selected video itag.")
-            return _download_and_merge_adaptive(stream, audio, output_dir_p, title, merge_adaptive)
+            return _download_and_merge_adaptive(stream, best_audio, output_dir_p, title, merge_adaptive)
     if quality.lower() in ("audio", "audio-only"):
-        audio = streams.filter(only_audio=True).order_by("abr").desc().first()
-        if not audio:
+        if not best_audio:
             raise RuntimeError("No audio stream available.")
-        out_name = unique_path(output_dir_p / (title + "." + audio.subtype))
-        logger.info("Downloading audio-only: %s", audio.abr)
-        path = audio.download(output_path=str(output_dir_p), filename=out_name.name)
-        return Path(path)
-    if re.match(r"^\d+p$", quality):
+        out_name = output_dir_p / (title + "." + best_audio.subtype)
+        logger.info("Downloading audio-only: %s", best_audio.abr)
+        return _fetch_new_file(best_audio, out_name)
+    if _RES_RE.match(quality):
         desired_res = quality
-        progressive = streams.filter(progressive=True, file_extension="mp4", res=desired_res).first()
-        progressive = progressive or streams.filter(progressive=True, resolution=desired_res).first()
+        progressive = _first_at_res(idx["pm"], desired_res) or _first_at_res(idx["pa"], desired_res)
         if progressive:
-            out_name = unique_path(output_dir_p / (title + "." + progressive.subtype))
+            out_name = output_dir_p / (title + "." + progressive.subtype)
             logger.info("Found progressive %s -> downloading", desired_res)
-            path = progressive.download(output_path=str(output_dir_p), filename=out_name.name)
-            return Path(path)
-        video_adaptive = streams.filter(adaptive=True, only_video=True, resolution=desired_res, file_extension="mp4").first()
+            return _fetch_new_file(progressive, out_name)
+        video_adaptive = _first_at_res(idx["am"], desired_res)
         if video_adaptive is None:
-            video_adaptive = streams.filter(adaptive=True, only_video=True).order_by("resolution").desc().first()
-        audio_adaptive = streams.filter(only_audio=True).order_by("abr").desc().first()
-        if not video_adaptive or not audio_adaptive:
+            video_adaptive = idx["aa"][0] if idx["aa"] else None
+        if not video_adaptive or not best_audio:
             raise RuntimeError("Could not find suitable video/audio streams for requested resolution.")
-        return _download_and_merge_adaptive(video_adaptive, audio_adaptive, output_dir_p, title, merge_adaptive)
-    best_prog = streams.filter(progressive=True, file_extension="mp4").order_by("resolution").desc().first()
+        return _download_and_merge_adaptive(video_adaptive, best_audio, output_dir_p, title, merge_adaptive)
+    best_prog = idx["pm"][0] if idx["pm"] else None
     if best_prog:
-        out_name = unique_path(output_dir_p / (title + "." + best_prog.subtype))
+        out_name = output_dir_p / (title + "." + best_prog.subtype)
         logger.info("Downloading best progressive: %s", getattr(best_prog, "resolution", "unknown"))
-        path = best_prog.download(output_path=str(output_dir_p), filename=out_name.name)
-        return Path(path)
-    best_video = streams.filter(adaptive=True, only_video=True, file_extension="mp4").order_by("resolution").desc().first()
-    best_audio = streams.filter(only_audio=True, file_extension="mp4").order_by("abr").desc().first()
-    if not best_video:
-        best_video = streams.filter(adaptive=True, only_video=True).order_by("resolution").desc().first()
-    if not best_audio:
-        best_audio = streams.filter(only_audio=True).order_by("abr").desc().first()
+        return _fetch_new_file(best_prog, out_name)
+    best_video = (idx["am"] or idx["aa"] or [None])[0]
+    best_audio = (idx["aum"] or idx["au"] or [None])[0]
     if not best_video or not best_audio:
         raise RuntimeError("No suitable streams found to download.")
     return _download_and_merge_adaptive(best_video, best_audio, output_dir_p, title, merge_adaptive)
 
 def _download_and_merge_adaptive(video_stream: Stream, audio_stream: Stream, output_dir: Path, title: str, merge_with_ffmpeg: bool) -> Path:
     logger.info("Adaptive download selected: video %s | audio %s", getattr(video_stream, "resolution", "V"), getattr(audio_stream, "abr", "A"))
-    with tempfile.TemporaryDirectory() as tmpdir:
+    ffmpeg_path = shutil.which("ffmpeg")
+    final_ext = ".mp4"
+    with tempfile.TemporaryDirectory(dir=str(output_dir), prefix=".ytdl-") as tmpdir:
         tmpdir_p = Path(tmpdir)
+        merged_tmp = tmpdir_p / ("merged" + final_ext)
+        if merge_with_ffmpeg and ffmpeg_path and _can_stream_mux(video_stream, audio_stream):
+            logger.info("Streaming video and audio into ffmpeg...")
+            res = _mux_streamed(ffmpeg_path, video_stream, audio_stream, merged_tmp)
+            if res.returncode == 0:
+                out_path = claim_path(output_dir / (title + final_ext))
+                os.replace(merged_tmp, out_path)
+                logger.info("Merged file saved to: %s", out_path)
+                return out_path
+            logger.warning("ffmpeg streamed merge failed, retrying via temporary files. ffmpeg stderr:\n%s", res.stderr.decode(errors="ignore"))
+            merged_tmp.unlink(missing_ok=True)
         video_tmp = tmpdir_p / f"video.{video_stream.subtype}"
         audio_tmp = tmpdir_p / f"audio.{audio_stream.subtype}"
-        logger.info("Downloading video to temporary file...")
-        video_stream.download(output_path=str(tmpdir_p), filename=video_tmp.name)
-        logger.info("Downloading audio to temporary file...")
-        audio_stream.download(output_path=str(tmpdir_p), filename=audio_tmp.name)
-        final_ext = ".mp4"
-        out_path = unique_path(output_dir / (title + final_ext))
-        ffmpeg_path = shutil.which("ffmpeg")
+        v_str, a_str = str(video_tmp), str(audio_tmp)
+        logger.info("Downloading video and audio to temporary files...")
+        # No ``with`` block: its shutdown(wait=True) would hold Ctrl-C until both streams finish.
+        cancel = threading.Event()
+        ex = ThreadPoolExecutor(max_workers=2)
+        try:
+            fv = ex.submit(_fetch_stream, video_stream, video_tmp, cancel)
+            fa = ex.submit(_fetch_stream, audio_stream, audio_tmp, cancel)
+            _wait_result(fv)
+            _wait_result(fa)
+        except BaseException:
+            cancel.set()
+            raise
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
         if merge_with_ffmpeg and ffmpeg_path:
             logger.info("Merging with ffmpeg...")
-            cmd_copy = [ffmpeg_path, "-y", "-i", str(video_tmp), "-i", str(audio_tmp), "-c", "copy", str(out_path)]
-            res = subprocess.run(cmd_copy, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            cmd_copy = _ffmpeg_mux_cmd(ffmpeg_path, v_str, a_str, merged_tmp, ["-c", "copy"])
+            res = subprocess.run(cmd_copy, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=PIPE_BUFSIZE)
+            if res.returncode != 0 and _probe_audio_codec(audio_tmp) in ("aac", "mp4a"):
+                logger.warning("ffmpeg copy into %s failed but audio is already AAC, retrying copy into .mkv...", final_ext)
+                final_ext = ".mkv"
+                merged_tmp = tmpdir_p / ("merged" + final_ext)
+                cmd_copy = _ffmpeg_mux_cmd(ffmpeg_path, v_str, a_str, merged_tmp, ["-c", "copy"])
+                res = subprocess.run(cmd_copy, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=PIPE_BUFSIZE)
             if res.returncode != 0:
                 logger.warning("ffmpeg copy failed, trying re-encode audio to AAC (slower)...")
-                cmd_reencode = [ffmpeg_path, "-y", "-i", str(video_tmp), "-i", str(audio_tmp), "-c:v", "copy", "-c:a", "aac", "-b:a", "192k", str(out_path)]
-                res2 = subprocess.run(cmd_reencode, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                final_ext = ".mp4"
+                merged_tmp = tmpdir_p / ("merged" + final_ext)
+                cmd_reencode = _ffmpeg_mux_cmd(ffmpeg_path, v_str, a_str, merged_tmp, ["-c:v", "copy", "-c:a", "aac", "-b:a", "192k"])
+                res2 = subprocess.run(cmd_reencode, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=PIPE_BUFSIZE)
                 if res2.returncode != 0:
                     logger.error("ffmpeg failed to merge streams. ffmpeg stderr:\n%s", res2.stderr.decode(errors="ignore"))
-                    fallback = unique_path(output_dir / video_tmp.name)
-                    shutil.move(str(video_tmp), str(fallback))
+                    fallback = claim_path(output_dir / video_tmp.name)
+                    _fast_move(video_tmp, fallback)
                     logger.warning("Saved video (no audio) to: %s", fallback)
                     return fallback
+            out_path = claim_path(output_dir / (title + final_ext))
+            os.replace(merged_tmp, out_path)
             logger.info("Merged file saved to: %s", out_path)
             return out_path
         else:
-            video_out = unique_path(output_dir / f"{title}_video.{video_tmp.suffix.lstrip('.') or video_tmp.suffix}")
-            audio_out = unique_path(output_dir / f"{title}_audio.{audio_tmp.suffix.lstrip('.') or audio_tmp.suffix}")
-            shutil.move(str(video_tmp), str(video_out))
-            shutil.move(str(audio_tmp), str(audio_out))
+            video_out = claim_path(output_dir / f"{title}_video.{video_tmp.suffix.lstrip('.') or video_tmp.suffix}")
+            audio_out = claim_path(output_dir / f"{title}_audio.{audio_tmp.suffix.lstrip('.') or audio_tmp.suffix}")
+            _fast_move(video_tmp, video_out)
+            _fast_move(audio_tmp, audio_out)
             logger.warning("ffmpeg not found or merging disabled. Saved separate files:\n  %s\n  %s", video_out, audio_out)
             return Path(video_out)
 
+async def _download_batch(urls: list[str], concurrency: int, **kwargs) -> list:
+    sem = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    # Own executor rather than the loop default: asyncio.run() joins the default
+    # executor on the way out, which would make Ctrl-C wait for every download.
+    ex = ThreadPoolExecutor(max_workers=concurrency)
+    async def one(url: str):
+        async with sem:
+            return await loop.run_in_executor(ex, functools.partial(download_video, url, **kwargs))
+    try:
+        return await asyncio.gather(*(one(u) for u in urls), return_exceptions=True)
+    except BaseException:
+        _ABORT.set()
+        raise
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
 def parse_args():
     p = argparse.ArgumentParser(description="YouTube downloader (pytube).")
-    p.add_argument("url", help="YouTube video URL")
+    p.add_argument("url", nargs="?", help="YouTube video URL")
+    p.add_argument("-a", "--batch-file", type=argparse.FileType("r", encoding="utf-8"), help="File with one URL per line ('-' for stdin)")
+    p.add_argument("-j", "--jobs", type=int, default=4, help="Number of videos to download concurrently in batch mode")
     p.add_argument("-o", "--output", default=".", help="Output directory")
     p.add_argument("-q", "--quality", default="best", help="Quality: best, audio, or e.g. 720p")
     p.add_argument("--list", action="store_true", help="List available streams and exit")
     p.add_argument("--itag", type=int, help="Specific stream itag to download")
     p.add_argument("--no-merge", action="store_true", help="Do not merge adaptive streams with ffmpeg")
-    return p.parse_args()
+    args = p.parse_args()
+    if not args.url and not args.batch_file:
+        p.error("a URL or --batch-file is required")
+    if args.jobs < 1:
+        p.error("--jobs must be at least 1")
+    return args
 
 def main():
     args = parse_args()
+    opts = dict(output_dir=args.output, quality=args.quality, list_streams=args.list, itag=args.itag, merge_adaptive=not args.no_merge)
     try:
-        result = download_video(url=args.url, output_dir=args.output, quality=args.quality, list_streams=args.list, itag=args.itag, merge_adaptive=not args.no_merge)
+        if args.batch_file:
+            with args.batch_file as f:
+                urls = [line.strip() for line in f]
+            urls = ([args.url] if args.url else []) + [u for u in urls if u and not u.startswith("#")]
+            # The same URL twice would only race itself into "title (1)".
+            urls = list(dict.fromkeys(urls))
+            _size_connection_pool(args.jobs)
+            results = asyncio.run(_download_batch(urls, args.jobs, **opts))
+            failed = 0
+            for url, result in zip(urls, results):
+                if isinstance(result, BaseException):
+                    failed += 1
+                    logger.error("Download failed for %s: %s", url, result)
+                elif result:
+                    logger.info("Final file: %s", result)
+            if failed:
+                logger.error("%d of %d downloads failed.", failed, len(urls))
+                sys.exit(4)
+            return
+        result = download_video(url=args.url, **opts)
         if result:
             logger.info("Final file: %s", result)
     except KeyboardInterrupt:
+        _ABORT.set()
         logger.info("Aborted by user.")
     except ValueError as ve:
         logger.error("Input error: %s", ve)
@@ -202,6 +717,8 @@ def main():
     except Exception as exc:
         logger.exception("Download failed: %s", exc)
         sys.exit(4)
+    finally:
+        _SESSION.close()
 
 if __name__ == "__main__":
     main()